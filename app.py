@@ -16,10 +16,16 @@ import sys
 import sqlite3
 import requests
 from datetime import datetime, date, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_from_directory
 import re
 import json
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cProfile
+import hmac
+import random
 
 # ==================== CONFIGURAÇÕES ====================
 app = Flask(__name__)
@@ -29,6 +35,28 @@ PORT = int(os.environ.get('PORT', 5000))
 DEBUG = os.environ.get('FLASK_ENV') != 'production'
 DB_FILE = 'assistente_financeiro.db'
 
+# Compactação dos lançamentos excluídos (tombstones)
+COMPACTACAO_INTERVALO_HORAS = float(os.environ.get('COMPACTACAO_INTERVALO_HORAS', 24))
+COMPACTACAO_RETENCAO_DIAS = int(os.environ.get('COMPACTACAO_RETENCAO_DIAS', 7))
+COMPACTACAO_TAMANHO_LOTE = int(os.environ.get('COMPACTACAO_TAMANHO_LOTE', 500))
+
+# Agendador: frequência da verificação e duração da reserva de uma tarefa
+AGENDADOR_VERIFICACAO_SEGUNDOS = int(os.environ.get('AGENDADOR_VERIFICACAO_SEGUNDOS', 60))
+AGENDADOR_RESERVA_MINUTOS = int(os.environ.get('AGENDADOR_RESERVA_MINUTOS', 60))
+
+# Resumos periódicos: 'diario', 'semanal' ou vazio (desativado)
+RESUMO_PERIODICIDADE = os.environ.get('RESUMO_PERIODICIDADE', '')
+RESUMO_HORARIO = os.environ.get('RESUMO_HORARIO', '08:00')  # HH:MM, hora do servidor
+RESUMO_DIA_SEMANA = int(os.environ.get('RESUMO_DIA_SEMANA', 0))  # 0 = segunda
+RESUMO_PROCESSOS = int(os.environ.get('RESUMO_PROCESSOS', 1))  # >1 só compensa com vários núcleos livres
+
+# Profiling sob demanda: desativado se não houver token nem amostragem
+PERFIL_TOKEN_ADMIN = os.environ.get('PERFIL_TOKEN_ADMIN', '')
+PERFIL_TAXA_AMOSTRAGEM = float(os.environ.get('PERFIL_TAXA_AMOSTRAGEM', 0))
+PERFIL_DIRETORIO = os.environ.get('PERFIL_DIRETORIO', 'perfis')
+PERFIL_MAX_ARQUIVOS = int(os.environ.get('PERFIL_MAX_ARQUIVOS', 50))
+PERFIL_HABILITADO = bool(PERFIL_TOKEN_ADMIN) or PERFIL_TAXA_AMOSTRAGEM > 0
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -56,10 +84,50 @@ def inicializar_banco():
                 data_lancamento DATETIME DEFAULT CURRENT_TIMESTAMP,
                 data_efetiva DATE DEFAULT (date('now')),
                 observacoes TEXT,
-                origem TEXT DEFAULT 'whatsapp'
+                origem TEXT DEFAULT 'whatsapp',
+                excluido_em DATETIME  -- tombstone: NULL = ativo
             )
         ''')
         
+        # Migração: bancos antigos não têm a coluna de exclusão lógica
+        cursor.execute("PRAGMA table_info(lancamentos)")
+        colunas = [coluna[1] for coluna in cursor.fetchall()]
+        if 'excluido_em' not in colunas:
+            try:
+                cursor.execute("ALTER TABLE lancamentos ADD COLUMN excluido_em DATETIME")
+                logger.info("🔧 Coluna excluido_em adicionada em lancamentos")
+            except sqlite3.OperationalError as e:
+                # Outro worker do gunicorn migrou ao mesmo tempo
+                if 'duplicate column' not in str(e):
+                    raise
+        
+        # Índice parcial dos lançamentos ativos: busca do "último" por usuário
+        # sem varrer a tabela e sem tocar em linhas excluídas
+        # tipo e valor no fim: o filtro de "cancelar receita de 1000" é avaliado
+        # no próprio índice. Substitui idx_lancamentos_usuario_data (sem eles)
+        cursor.execute("DROP INDEX IF EXISTS idx_lancamentos_usuario_data")
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lancamentos_ativos_usuario
+            ON lancamentos (usuario, data_lancamento DESC, id DESC, tipo, valor)
+            WHERE excluido_em IS NULL
+        ''')
+        
+        # Índice de cobertura para o resumo periódico: varredura única por
+        # intervalo de datas, sem ler a tabela (excluido_em entra só para
+        # o SQLite reconhecer a cobertura)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lancamentos_resumo
+            ON lancamentos (data_efetiva, usuario, tipo, categoria, valor, excluido_em)
+            WHERE excluido_em IS NULL
+        ''')
+        
+        # Índice parcial dos tombstones para a compactação em lotes
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lancamentos_excluidos
+            ON lancamentos (excluido_em)
+            WHERE excluido_em IS NOT NULL
+        ''')
+        
         # Tabela de categorias personalizadas por usuário
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS categorias_usuario (
@@ -72,6 +140,35 @@ def inicializar_banco():
             )
         ''')
         
+        # Controle das tarefas agendadas (uma execução por horário, em um só processo)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tarefas_agendadas (
+                nome TEXT PRIMARY KEY,
+                ultima_execucao DATETIME,  -- horário agendado da última execução concluída
+                bloqueado_ate DATETIME     -- reserva do processo que está executando
+            )
+        ''')
+        
+        # Fila de saída persistida: uma mensagem por (lote, usuario), marcada
+        # com enviado_em assim que sai, para um retry não reenviar
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fila_saida (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lote TEXT NOT NULL,  -- ex.: 'resumos 2026-10-19 08:00:00'
+                usuario TEXT NOT NULL,
+                mensagem TEXT NOT NULL,
+                criado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
+                enviado_em DATETIME,
+                UNIQUE (lote, usuario)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_fila_saida_pendentes
+            ON fila_saida (lote, id)
+            WHERE enviado_em IS NULL
+        ''')
+        
         # Tabela de configurações por usuário
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS configuracoes_usuario (
@@ -131,15 +228,16 @@ def processar_comando_ia(mensagem, usuario):
     if any(palavra in mensagem_lower for palavra in palavras_ajuda):
         return gerar_mensagem_ajuda()
     
+    # Verificar se é comando de exclusão (antes dos relatórios: "remover"
+    # contém "ver", que é palavra-chave de relatório). Só o formato exato
+    # do comando conta: "paguei 30 para cancelar a assinatura" é um gasto
+    if PADRAO_EXCLUSAO.match(mensagem_lower):
+        return processar_exclusao(mensagem_lower, usuario)
+    
     # Verificar se é comando de relatório
     if any(palavra in mensagem_lower for palavra in palavras_relatorio):
         return gerar_relatorio_inteligente(mensagem_lower, usuario)
     
-    # Verificar se é comando de exclusão
-    palavras_exclusao = ['deletar', 'delete', 'excluir', 'apagar', 'remover', 'cancelar']
-    if any(palavra in mensagem_lower for palavra in palavras_exclusao):
-        return processar_exclusao(mensagem_lower, usuario)
-    
     # Analisar lançamento financeiro
     analise = analisar_lancamento_financeiro(mensagem_original)
     
@@ -354,7 +452,7 @@ def gerar_relatorio_inteligente(comando, usuario):
         cursor.execute(f"""
             SELECT SUM(valor), COUNT(*) 
             FROM lancamentos 
-            WHERE usuario = ? AND tipo = 'gasto' AND {filtro_data}
+            WHERE usuario = ? AND excluido_em IS NULL AND tipo = 'gasto' AND {filtro_data}
         """, [usuario] + params_data)
         resultado_gastos = cursor.fetchone()
         total_gastos = resultado_gastos[0] or 0
@@ -364,7 +462,7 @@ def gerar_relatorio_inteligente(comando, usuario):
         cursor.execute(f"""
             SELECT SUM(valor), COUNT(*) 
             FROM lancamentos 
-            WHERE usuario = ? AND tipo = 'receita' AND {filtro_data}
+            WHERE usuario = ? AND excluido_em IS NULL AND tipo = 'receita' AND {filtro_data}
         """, [usuario] + params_data)
         resultado_receitas = cursor.fetchone()
         total_receitas = resultado_receitas[0] or 0
@@ -374,7 +472,7 @@ def gerar_relatorio_inteligente(comando, usuario):
         cursor.execute(f"""
             SELECT categoria, SUM(valor), COUNT(*)
             FROM lancamentos 
-            WHERE usuario = ? AND tipo = 'gasto' AND {filtro_data}
+            WHERE usuario = ? AND excluido_em IS NULL AND tipo = 'gasto' AND {filtro_data}
             GROUP BY categoria
             ORDER BY SUM(valor) DESC
             LIMIT 5
@@ -385,7 +483,7 @@ def gerar_relatorio_inteligente(comando, usuario):
         cursor.execute(f"""
             SELECT tipo, valor, descricao, categoria, date(data_efetiva)
             FROM lancamentos 
-            WHERE usuario = ? AND {filtro_data}
+            WHERE usuario = ? AND excluido_em IS NULL AND {filtro_data}
             ORDER BY data_lancamento DESC 
             LIMIT 8
         """, [usuario] + params_data)
@@ -435,11 +533,43 @@ def gerar_relatorio_inteligente(comando, usuario):
         logger.error(f"❌ Erro ao gerar relatório: {e}")
         return f"❌ **Erro ao consultar dados:** {str(e)}\n\nTente novamente em alguns segundos."
 
+# Comando de exclusão: verbo no início, depois "último", tipo e valor opcionais
+# ("deletar último gasto", "cancelar receita de 1000", "apagar o último lançamento")
+PADRAO_EXCLUSAO = re.compile(r"""
+    ^(?:deletar|delete|excluir|apagar|remover|cancelar)\b
+    (?:\s+(?:o|a|meu|minha))?
+    (?:\s+(?P<ultimo>[úu]ltim[oa]))?
+    (?:\s+(?P<tipo>gasto|despesa|receita|lan[çc]amento))?
+    (?:\s+(?:de\s+)?(?:r\$\s*)?(?P<valor>\d+(?:[,\.]\d{1,2})?)(?:\s*reais?)?)?
+    [\s.!]*$
+""", re.VERBOSE)
+
 def processar_exclusao(comando, usuario):
-    """Processar comandos de exclusão de lançamentos"""
+    """
+    Processar comandos de exclusão de lançamentos
     
-    # Por enquanto, retorna instrução de exclusão manual
-    return """🗑️ **EXCLUSÃO DE LANÇAMENTOS**
+    Exemplos: "deletar último gasto", "remover último lançamento",
+    "cancelar receita de 1000". A exclusão é lógica (tombstone); a linha
+    só é apagada de fato pela compactação periódica.
+    """
+    
+    match = PADRAO_EXCLUSAO.match(comando)
+    
+    # Tipo alvo (None = qualquer tipo)
+    if match.group('tipo') == 'receita':
+        tipo = 'receita'
+    elif match.group('tipo') in ('gasto', 'despesa'):
+        tipo = 'gasto'
+    else:
+        tipo = None
+    
+    # Valor alvo, se informado ("cancelar receita de 1000")
+    valor = None
+    if match.group('valor'):
+        valor = float(match.group('valor').replace(',', '.'))
+    
+    if not match.group('ultimo') and valor is None:
+        return """🗑️ **EXCLUSÃO DE LANÇAMENTOS**
 
 Para excluir lançamentos, você pode:
 
@@ -452,7 +582,35 @@ Para excluir lançamentos, você pode:
 • "relatório de hoje"
 • "meus gastos recentes"
 
-⚠️ **Atenção:** Exclusões são permanentes!"""
+⚠️ **Atenção:** Lançamentos excluídos deixam de aparecer nos relatórios!"""
+    
+    lancamento = excluir_lancamento(usuario, tipo, valor)
+    
+    if lancamento is False:
+        return "❌ **Erro ao excluir lançamento.**\n\nTente novamente em alguns segundos."
+    
+    if lancamento is None:
+        filtro = tipo.title() if tipo else 'Qualquer tipo'
+        if valor is not None:
+            filtro += f" de R$ {valor:.2f}"
+        return f"""🔍 **Nenhum lançamento encontrado para excluir.**
+
+🔎 **Filtro:** {filtro}
+
+📊 Digite **"relatório de hoje"** para ver seus últimos lançamentos."""
+    
+    tipo_excluido, valor_excluido, descricao, categoria, data_efetiva = lancamento
+    data_formatada = datetime.strptime(data_efetiva, '%Y-%m-%d').strftime('%d/%m/%Y')
+    
+    return f"""🗑️ **Lançamento excluído com sucesso!**
+
+📌 **Tipo:** {tipo_excluido.title()}
+💵 **Valor:** R$ {valor_excluido:.2f}
+📝 **Descrição:** {descricao}
+🏷️ **Categoria:** {categoria}
+📅 **Data:** {data_formatada}
+
+✅ O lançamento não aparece mais nos relatórios."""
 
 def gerar_mensagem_ajuda():
     """Gerar mensagem de ajuda completa"""
@@ -483,6 +641,8 @@ Alimentação, Transporte, Moradia, Saúde, Lazer, Educação, Vestuário, Traba
 • "ajuda" - Esta mensagem
 • "relatório" - Resumo geral
 • "saldo" - Saldo atual
+• "deletar último gasto" - Exclui o último gasto
+• "cancelar receita de 1000" - Exclui a última receita desse valor
 
 ✨ **DICAS:**
 • Use linguagem natural
@@ -502,7 +662,7 @@ def salvar_lancamento(usuario, tipo, valor, descricao, categoria='Outros'):
             INSERT INTO lancamentos 
             (usuario, tipo, valor, descricao, categoria, data_efetiva)
             VALUES (?, ?, ?, ?, ?, date('now'))
-        """, (usuario, tipo, valor, descricao, categoria))
+        """, (usuario, tipo, round(valor, 2), descricao, categoria))
         
         lancamento_id = cursor.lastrowid
         conn.commit()
@@ -515,6 +675,662 @@ def salvar_lancamento(usuario, tipo, valor, descricao, categoria='Outros'):
         logger.error(f"❌ Erro ao salvar lançamento: {e}")
         return False
 
+def excluir_lancamento(usuario, tipo=None, valor=None):
+    """
+    Excluir logicamente o lançamento ativo mais recente do usuário
+    
+    A busca percorre o índice parcial idx_lancamentos_ativos_usuario
+    (usuario, data_lancamento DESC, id DESC, tipo, valor), testa tipo/valor
+    no próprio índice e só lê da tabela a linha encontrada. O valor é
+    comparado direto (sem ROUND) porque salvar_lancamento já grava arredondado.
+    
+    Returns:
+        tuple: (tipo, valor, descricao, categoria, data_efetiva), None se
+        nenhum lançamento bater ou False em caso de erro no banco
+    """
+    
+    filtros = ["usuario = ?", "excluido_em IS NULL"]
+    params = [usuario]
+    
+    if tipo:
+        filtros.append("tipo = ?")
+        params.append(tipo)
+    
+    if valor is not None:
+        filtros.append("valor = ?")
+        params.append(round(valor, 2))
+    
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        
+        cursor.execute(f"""
+            SELECT id, tipo, valor, descricao, categoria, date(data_efetiva)
+            FROM lancamentos
+            WHERE {' AND '.join(filtros)}
+            ORDER BY data_lancamento DESC, id DESC
+            LIMIT 1
+        """, params)
+        alvo = cursor.fetchone()
+        
+        if alvo is None:
+            conn.close()
+            return None
+        
+        # "excluido_em IS NULL" evita marcar duas vezes em exclusões concorrentes
+        cursor.execute("""
+            UPDATE lancamentos
+            SET excluido_em = CURRENT_TIMESTAMP
+            WHERE id = ? AND excluido_em IS NULL
+        """, (alvo[0],))
+        excluido = cursor.rowcount == 1
+        
+        conn.commit()
+        conn.close()
+        
+        if not excluido:
+            return None
+        
+        logger.info(f"🗑️ Lançamento {alvo[0]} excluído ({alvo[1]} R$ {alvo[2]:.2f}) para {usuario}")
+        return alvo[1:]
+        
+    except Exception as e:
+        logger.error(f"❌ Erro ao excluir lançamento: {e}")
+        return False
+
+def compactar_lancamentos_excluidos(retencao_dias=None, tamanho_lote=None):
+    """
+    Apagar definitivamente os lançamentos excluídos há mais de `retencao_dias`
+    
+    Remove em lotes de `tamanho_lote` linhas, com um commit por lote, para
+    não segurar o lock de escrita do SQLite durante a compactação inteira.
+    
+    Returns:
+        int: Total de lançamentos removidos
+    """
+    
+    retencao_dias = COMPACTACAO_RETENCAO_DIAS if retencao_dias is None else retencao_dias
+    tamanho_lote = tamanho_lote or COMPACTACAO_TAMANHO_LOTE
+    total_removidos = 0
+    
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        
+        while True:
+            cursor.execute("""
+                DELETE FROM lancamentos
+                WHERE id IN (
+                    SELECT id FROM lancamentos
+                    WHERE excluido_em IS NOT NULL
+                      AND excluido_em < datetime('now', ?)
+                    LIMIT ?
+                )
+            """, (f'-{retencao_dias} days', tamanho_lote))
+            removidos = cursor.rowcount
+            conn.commit()
+            
+            total_removidos += removidos
+            if removidos < tamanho_lote:
+                break
+        
+        conn.close()
+        
+        logger.info(f"🧹 Compactação concluída: {total_removidos} lançamentos removidos")
+        return total_removidos
+        
+    except Exception as e:
+        logger.error(f"❌ Erro na compactação: {e}")
+        return total_removidos
+
+# ==================== TAREFAS PERIÓDICAS ====================
+# O agendador roda em todo processo que serve requisições (workers do
+# gunicorn, filho do reloader). A reserva em tarefas_agendadas garante que
+# cada horário seja executado uma única vez, por um só processo, e o registro
+# de ultima_execucao faz um restart retomar o horário pendente sem repetir.
+
+FORMATO_DATA_HORA = '%Y-%m-%d %H:%M:%S'
+
+# Sinal para encerrar o agendador
+parar_tarefas = threading.Event()
+
+trava_agendador = threading.Lock()
+agendador_iniciado = False
+
+def horario_por_intervalo(horas):
+    """Horário devido de uma tarefa que roda a cada `horas` (alinhado à época)"""
+    
+    intervalo = horas * 3600
+    
+    def horario_devido(agora):
+        timestamp = agora.timestamp()
+        return datetime.fromtimestamp(timestamp - timestamp % intervalo).replace(microsecond=0)
+    
+    return horario_devido
+
+def reservar_tarefa(nome, horario, agora):
+    """
+    Reservar a execução de `nome` para `horario`
+    
+    Na primeira vez que a tarefa aparece, o horário atual já é dado como
+    atendido: ativar um resumo semanal na quinta não dispara o resumo
+    atrasado de segunda, e a primeira execução fica para o próximo horário.
+    
+    Returns:
+        bool: True se este processo deve executar a tarefa agora
+    """
+    
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "INSERT OR IGNORE INTO tarefas_agendadas (nome, ultima_execucao) VALUES (?, ?)",
+        (nome, horario.strftime(FORMATO_DATA_HORA))
+    )
+    if cursor.rowcount == 1:
+        conn.commit()
+        conn.close()
+        logger.info(f"⏰ Tarefa {nome} registrada; primeira execução no próximo horário")
+        return False
+    
+    # Um só UPDATE: entre processos concorrentes, apenas um afeta a linha
+    cursor.execute("""
+        UPDATE tarefas_agendadas
+        SET bloqueado_ate = ?
+        WHERE nome = ?
+          AND (ultima_execucao IS NULL OR ultima_execucao < ?)
+          AND (bloqueado_ate IS NULL OR bloqueado_ate < ?)
+    """, (
+        (agora + timedelta(minutes=AGENDADOR_RESERVA_MINUTOS)).strftime(FORMATO_DATA_HORA),
+        nome,
+        horario.strftime(FORMATO_DATA_HORA),
+        agora.strftime(FORMATO_DATA_HORA)
+    ))
+    reservada = cursor.rowcount == 1
+    
+    conn.commit()
+    conn.close()
+    return reservada
+
+def renovar_reserva(nome):
+    """Estender a reserva de `nome` enquanto a tarefa ainda está rodando"""
+    
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        conn.execute("""
+            UPDATE tarefas_agendadas
+            SET bloqueado_ate = ?
+            WHERE nome = ? AND bloqueado_ate IS NOT NULL
+        """, (
+            (datetime.now() + timedelta(minutes=AGENDADOR_RESERVA_MINUTOS)).strftime(FORMATO_DATA_HORA),
+            nome
+        ))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"❌ Erro ao renovar reserva da tarefa {nome}: {e}")
+
+def concluir_tarefa(nome, horario):
+    """Registrar a execução de `nome` para `horario` e liberar a reserva"""
+    
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("""
+        UPDATE tarefas_agendadas
+        SET ultima_execucao = ?, bloqueado_ate = NULL
+        WHERE nome = ?
+    """, (horario.strftime(FORMATO_DATA_HORA), nome))
+    conn.commit()
+    conn.close()
+
+def executar_tarefas_devidas(tarefas, agora=None):
+    """
+    Executar as tarefas cujo horário devido ainda não foi atendido
+    
+    Args:
+        tarefas (dict): nome -> (funcao(horario), horario_devido(agora))
+    """
+    
+    agora = agora or datetime.now()
+    
+    for nome, (funcao, horario_devido) in tarefas.items():
+        horario = horario_devido(agora)
+        
+        try:
+            if not reservar_tarefa(nome, horario, agora):
+                continue
+            
+            logger.info(f"⏰ Executando tarefa {nome} (horário {horario.strftime(FORMATO_DATA_HORA)})")
+            
+            # Renova a reserva a cada 1/3 do prazo: uma tarefa longa (envio
+            # de resumos) não pode ser assumida por outro processo no meio
+            fim_tarefa = threading.Event()
+            
+            def manter_reserva():
+                while not fim_tarefa.wait(AGENDADOR_RESERVA_MINUTOS * 60 / 3):
+                    renovar_reserva(nome)
+            
+            threading.Thread(target=manter_reserva, name=f'reserva-{nome}', daemon=True).start()
+            try:
+                funcao(horario)
+            finally:
+                fim_tarefa.set()
+            concluir_tarefa(nome, horario)
+            
+        except Exception as e:
+            # Sem concluir: a reserva expira e outro ciclo tenta de novo
+            logger.error(f"❌ Erro na tarefa agendada {nome}: {e}")
+
+def iniciar_agendador():
+    """Iniciar a thread do agendador (uma vez por processo)"""
+    
+    global agendador_iniciado
+    
+    with trava_agendador:
+        if agendador_iniciado:
+            return None
+        agendador_iniciado = True
+    
+    tarefas = {
+        'compactacao': (
+            lambda horario: compactar_lancamentos_excluidos(),
+            horario_por_intervalo(COMPACTACAO_INTERVALO_HORAS)
+        )
+    }
+    
+    # Resumos periódicos (opt-in via RESUMO_PERIODICIDADE)
+    if RESUMO_PERIODICIDADE in ('diario', 'semanal'):
+        tarefas['resumos'] = (executar_resumos_periodicos, horario_resumo)
+    
+    def executar():
+        # Verifica já na partida: um restart não pula o horário pendente
+        while True:
+            executar_tarefas_devidas(tarefas)
+            if parar_tarefas.wait(AGENDADOR_VERIFICACAO_SEGUNDOS):
+                break
+    
+    thread = threading.Thread(target=executar, name='agendador', daemon=True)
+    thread.start()
+    logger.info(f"⏰ Agendador iniciado: {', '.join(tarefas)}")
+    return thread
+
+# ==================== RESUMOS PERIÓDICOS ====================
+def carregar_resumos_periodicos(periodicidade, data_referencia=None):
+    """
+    Agregar os lançamentos do período de todos os usuários com notificações
+    
+    Uma única consulta agrupada sobre `lancamentos` (via idx_lancamentos_resumo)
+    substitui as 4 consultas por usuário de gerar_relatorio_inteligente.
+    Usuários sem linha em configuracoes_usuario seguem o padrão da coluna
+    (notificacoes = 1). Só entra quem tem lançamentos no período: usuários
+    sem movimento não recebem resumo.
+    
+    Yields:
+        tuple: (usuario, periodo_nome, total_receitas, qtd_receitas,
+                total_gastos, qtd_gastos, [(categoria, valor), ...])
+    """
+    
+    # Só dias completos: o resumo cobre até ontem, nunca o dia em andamento
+    hoje = data_referencia or date.today()
+    data_fim = hoje - timedelta(days=1)
+    
+    if periodicidade == 'semanal':
+        data_inicio = hoje - timedelta(days=7)
+        periodo_nome = "últimos 7 dias"
+    else:
+        data_inicio = data_fim
+        periodo_nome = "ontem"
+    
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        SELECT usuario, tipo, categoria, SUM(valor), COUNT(*)
+        FROM lancamentos
+        WHERE excluido_em IS NULL
+          AND data_efetiva >= ? AND data_efetiva <= ?
+          AND usuario NOT IN (
+              SELECT usuario FROM configuracoes_usuario WHERE notificacoes = 0
+          )
+        GROUP BY usuario, tipo, categoria
+        ORDER BY usuario, tipo, categoria
+    """, (str(data_inicio), str(data_fim)))
+    
+    # Linhas chegam ordenadas por usuário: fecha um resumo a cada troca
+    usuario_atual = None
+    for usuario, tipo, categoria, total, quantidade in cursor:
+        if usuario != usuario_atual:
+            if usuario_atual is not None:
+                yield (usuario_atual, periodo_nome, total_receitas, qtd_receitas,
+                       total_gastos, qtd_gastos, categorias)
+            usuario_atual = usuario
+            total_receitas = total_gastos = 0
+            qtd_receitas = qtd_gastos = 0
+            categorias = []
+        
+        if tipo == 'receita':
+            total_receitas += total
+            qtd_receitas += quantidade
+        else:
+            total_gastos += total
+            qtd_gastos += quantidade
+            categorias.append((categoria or 'Outros', total))
+    
+    if usuario_atual is not None:
+        yield (usuario_atual, periodo_nome, total_receitas, qtd_receitas,
+               total_gastos, qtd_gastos, categorias)
+    
+    conn.close()
+
+def renderizar_resumo_periodico(resumo):
+    """
+    Montar a mensagem do resumo periódico de um usuário
+    
+    Função de módulo (e não closure) para poder rodar no pool de processos.
+    
+    Returns:
+        tuple: (usuario, mensagem)
+    """
+    
+    (usuario, periodo_nome, total_receitas, qtd_receitas,
+     total_gastos, qtd_gastos, categorias) = resumo
+    
+    saldo = total_receitas - total_gastos
+    saldo_emoji = "✅" if saldo >= 0 else "❌"
+    
+    mensagem = f"""📬 **RESUMO FINANCEIRO - {periodo_nome.upper()}**
+
+• 📈 Receitas: R$ {total_receitas:.2f} ({qtd_receitas} lançamentos)
+• 📉 Gastos: R$ {total_gastos:.2f} ({qtd_gastos} lançamentos)
+• 💵 **Saldo: R$ {saldo:.2f}** {saldo_emoji}
+"""
+    
+    if categorias:
+        mensagem += "\n🏷️ **PRINCIPAIS CATEGORIAS:**\n"
+        for categoria, valor in sorted(categorias, key=lambda item: item[1], reverse=True)[:3]:
+            percentual = (valor / total_gastos * 100) if total_gastos > 0 else 0
+            mensagem += f"• {categoria}: R$ {valor:.2f} ({percentual:.1f}%)\n"
+    
+    mensagem += "\n📊 Digite **\"relatório\"** para ver os detalhes."
+    
+    return usuario, mensagem
+
+class EnviadorLocal:
+    """Enviador de teste: guarda as mensagens em memória em vez de enviá-las"""
+    
+    def __init__(self):
+        self.enviadas = []
+    
+    def enviar(self, usuario, mensagem):
+        self.enviadas.append((usuario, mensagem))
+
+class EnviadorTwilio:
+    """Enviador real via API REST do Twilio (WhatsApp)"""
+    
+    def __init__(self, account_sid, auth_token, numero_origem):
+        from twilio.rest import Client
+        self.client = Client(account_sid, auth_token)
+        
+        # TWILIO_PHONE_NUMBER costuma vir como número puro; o canal WhatsApp
+        # exige o prefixo (o destino já vem com ele, do campo From)
+        if not numero_origem.startswith('whatsapp:'):
+            numero_origem = f"whatsapp:{numero_origem}"
+        self.numero_origem = numero_origem
+    
+    def enviar(self, usuario, mensagem):
+        self.client.messages.create(from_=self.numero_origem, to=usuario, body=mensagem)
+
+def criar_enviador():
+    """Usar o Twilio se as credenciais existirem, senão o enviador local"""
+    
+    account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
+    auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
+    numero_origem = os.environ.get('TWILIO_PHONE_NUMBER')
+    
+    if account_sid and auth_token and numero_origem:
+        return EnviadorTwilio(account_sid, auth_token, numero_origem)
+    
+    logger.warning("⚠️ Credenciais Twilio ausentes, usando enviador local")
+    return EnviadorLocal()
+
+class FilaSaida:
+    """
+    Fila de mensagens de saída persistida em `fila_saida`, com enviador plugável
+    
+    As mensagens são únicas por (lote, usuario) e recebem enviado_em assim
+    que saem: despachar o mesmo lote de novo (retry, restart no meio do
+    envio) só envia o que faltou. Qualquer objeto com
+    `enviar(usuario, mensagem)` serve como enviador.
+    """
+    
+    TAMANHO_BUFFER = 1000
+    
+    def __init__(self, enviador, lote):
+        self.enviador = enviador
+        self.lote = lote
+        self.buffer = []
+    
+    def enfileirar(self, usuario, mensagem):
+        self.buffer.append((self.lote, usuario, mensagem))
+        if len(self.buffer) >= self.TAMANHO_BUFFER:
+            self.gravar()
+    
+    def gravar(self):
+        """Persistir o buffer; mensagens já existentes no lote são ignoradas"""
+        
+        if not self.buffer:
+            return
+        
+        conn = sqlite3.connect(DB_FILE)
+        conn.executemany("""
+            INSERT OR IGNORE INTO fila_saida (lote, usuario, mensagem)
+            VALUES (?, ?, ?)
+        """, self.buffer)
+        conn.commit()
+        conn.close()
+        self.buffer = []
+    
+    def despachar(self):
+        """
+        Enviar as mensagens ainda não enviadas do lote
+        
+        Cada envio é marcado (com commit) logo em seguida; se o processo
+        morrer, no máximo a mensagem em andamento é repetida.
+        
+        Returns:
+            tuple: (enviadas, falhas)
+        """
+        
+        self.gravar()
+        
+        conn = sqlite3.connect(DB_FILE)
+        pendentes = conn.execute("""
+            SELECT id, usuario, mensagem
+            FROM fila_saida
+            WHERE lote = ? AND enviado_em IS NULL
+            ORDER BY id
+        """, (self.lote,)).fetchall()
+        
+        enviadas = falhas = 0
+        for id_mensagem, usuario, mensagem in pendentes:
+            try:
+                self.enviador.enviar(usuario, mensagem)
+            except Exception as e:
+                falhas += 1
+                logger.error(f"❌ Erro ao enviar mensagem para {usuario}: {e}")
+                continue
+            
+            conn.execute(
+                "UPDATE fila_saida SET enviado_em = CURRENT_TIMESTAMP WHERE id = ?",
+                (id_mensagem,)
+            )
+            conn.commit()
+            enviadas += 1
+        
+        conn.close()
+        return enviadas, falhas
+
+def limpar_fila_saida(dias=30):
+    """Apagar da fila de saída as mensagens criadas há mais de `dias`"""
+    
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.execute(
+        "DELETE FROM fila_saida WHERE criado_em < datetime('now', ?)",
+        (f'-{dias} days',)
+    )
+    removidas = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return removidas
+
+def gerar_resumos_periodicos(periodicidade, fila, processos=None, data_referencia=None):
+    """
+    Gerar o resumo de todos os usuários com notificações e enfileirar em `fila`
+    
+    A agregação é uma só consulta; a renderização roda em um pool de processos
+    quando `processos` > 1.
+    
+    Returns:
+        int: Quantidade de resumos enfileirados
+    """
+    
+    processos = processos or RESUMO_PROCESSOS
+    # Materializa antes de enfileirar: com o cursor da consulta aberto, o
+    # lock de leitura do SQLite bloquearia as escritas em fila_saida
+    resumos = list(carregar_resumos_periodicos(periodicidade, data_referencia))
+    total = 0
+    
+    if processos > 1:
+        # 'spawn': o job roda em uma thread do servidor, e fork com threads
+        # ativas pode herdar locks travados
+        contexto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=processos, mp_context=contexto) as pool:
+            for usuario, mensagem in pool.map(renderizar_resumo_periodico, resumos, chunksize=1000):
+                fila.enfileirar(usuario, mensagem)
+                total += 1
+    else:
+        for usuario, mensagem in map(renderizar_resumo_periodico, resumos):
+            fila.enfileirar(usuario, mensagem)
+            total += 1
+    
+    logger.info(f"📬 {total} resumos ({periodicidade}) enfileirados")
+    return total
+
+def horario_resumo(agora):
+    """
+    Último horário devido do resumo: todo dia (ou todo RESUMO_DIA_SEMANA,
+    no semanal) às RESUMO_HORARIO
+    """
+    
+    hora, minuto = (int(parte) for parte in RESUMO_HORARIO.split(':'))
+    horario = agora.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+    
+    if RESUMO_PERIODICIDADE == 'semanal':
+        horario -= timedelta(days=(horario.weekday() - RESUMO_DIA_SEMANA) % 7)
+        if horario > agora:
+            horario -= timedelta(days=7)
+    elif horario > agora:
+        horario -= timedelta(days=1)
+    
+    return horario
+
+def executar_resumos_periodicos(horario):
+    """
+    Tarefa agendada: gerar e enviar os resumos da periodicidade configurada
+    
+    O período é calculado a partir do horário agendado, e não da hora da
+    execução: um resumo atrasado por restart cobre os mesmos dias.
+    """
+    
+    # O lote é o horário agendado: um retry do mesmo horário reaproveita a
+    # fila e pula quem já recebeu
+    fila = FilaSaida(criar_enviador(), f"resumos {horario.strftime(FORMATO_DATA_HORA)}")
+    gerar_resumos_periodicos(RESUMO_PERIODICIDADE, fila, data_referencia=horario.date())
+    enviadas, falhas = fila.despachar()
+    logger.info(f"📤 Resumos enviados: {enviadas} (falhas: {falhas})")
+    
+    limpar_fila_saida()
+
+# ==================== PROFILING ====================
+# Um perfil por vez por processo: requisições concorrentes seguem sem perfil
+trava_perfil = threading.Lock()
+
+def token_admin_valido():
+    """Conferir o cabeçalho X-Admin-Token da requisição atual"""
+    
+    if not PERFIL_TOKEN_ADMIN:
+        return False
+    
+    token = request.headers.get('X-Admin-Token', '')
+    return hmac.compare_digest(token.encode('utf-8'), PERFIL_TOKEN_ADMIN.encode('utf-8'))
+
+def deve_perfilar():
+    """Perfilar se pedido via `X-Profile: 1` (com token admin) ou por amostragem"""
+    
+    if request.headers.get('X-Profile') == '1' and token_admin_valido():
+        return True
+    
+    return PERFIL_TAXA_AMOSTRAGEM > 0 and random.random() < PERFIL_TAXA_AMOSTRAGEM
+
+def executar_com_perfil(funcao, *args):
+    """Executar `funcao` sob cProfile e gravar as estatísticas em PERFIL_DIRETORIO"""
+    
+    if not trava_perfil.acquire(blocking=False):
+        return funcao(*args)
+    
+    try:
+        perfil = cProfile.Profile()
+        try:
+            return perfil.runcall(funcao, *args)
+        finally:
+            salvar_perfil(perfil)
+    finally:
+        trava_perfil.release()
+
+def salvar_perfil(perfil):
+    """Gravar o perfil e apagar os mais antigos além de PERFIL_MAX_ARQUIVOS"""
+    
+    try:
+        os.makedirs(PERFIL_DIRETORIO, exist_ok=True)
+        nome = f"perfil_{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{os.getpid()}.prof"
+        perfil.dump_stats(os.path.join(PERFIL_DIRETORIO, nome))
+        logger.info(f"🔬 Perfil gravado: {nome}")
+        
+        # Rotação: vários workers gravam no mesmo diretório, então ordena por mtime
+        for antigo in listar_perfis()[PERFIL_MAX_ARQUIVOS:]:
+            try:
+                os.remove(os.path.join(PERFIL_DIRETORIO, antigo['nome']))
+            except FileNotFoundError:
+                pass
+        
+    except Exception as e:
+        logger.error(f"❌ Erro ao gravar perfil: {e}")
+
+def listar_perfis():
+    """Listar os perfis gravados, do mais recente para o mais antigo"""
+    
+    if not os.path.isdir(PERFIL_DIRETORIO):
+        return []
+    
+    perfis = []
+    for nome in os.listdir(PERFIL_DIRETORIO):
+        if not nome.endswith('.prof'):
+            continue
+        try:
+            info = os.stat(os.path.join(PERFIL_DIRETORIO, nome))
+        except FileNotFoundError:
+            continue
+        perfis.append((info.st_mtime, nome, info.st_size))
+    
+    perfis.sort(reverse=True)
+    return [
+        {
+            'nome': nome,
+            'tamanho': tamanho,
+            'criado_em': datetime.fromtimestamp(mtime).isoformat()
+        }
+        for mtime, nome, tamanho in perfis
+    ]
+
 # ==================== ROUTES FLASK ====================
 
 @app.route('/')
@@ -526,10 +1342,10 @@ def home():
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
         
-        cursor.execute("SELECT COUNT(*) FROM lancamentos")
+        cursor.execute("SELECT COUNT(*) FROM lancamentos WHERE excluido_em IS NULL")
         total_lancamentos = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(DISTINCT usuario) FROM lancamentos")
+        cursor.execute("SELECT COUNT(DISTINCT usuario) FROM lancamentos WHERE excluido_em IS NULL")
         total_usuarios = cursor.fetchone()[0]
         
         conn.close()
@@ -611,9 +1427,12 @@ def webhook():
             logger.warning("⚠️ Mensagem vazia recebida")
             return "❌ Mensagem vazia", 400
         
-        # Processar comando com IA
+        # Processar comando com IA (sob cProfile se amostrado ou pedido)
         logger.info("🧠 Iniciando processamento IA...")
-        resposta = processar_comando_ia(message_body, from_number)
+        if PERFIL_HABILITADO and deve_perfilar():
+            resposta = executar_com_perfil(processar_comando_ia, message_body, from_number)
+        else:
+            resposta = processar_comando_ia(message_body, from_number)
         logger.info(f"✅ IA processou: {len(resposta)} caracteres gerados")
         
         logger.info(f"📤 Enviando resposta para {from_number}")
@@ -660,6 +1479,27 @@ def status():
         'environment': 'production' if not DEBUG else 'development'
     })
 
+@app.route('/perfis')
+def perfis():
+    """Listar os perfis recentes (requer X-Admin-Token)"""
+    
+    if not token_admin_valido():
+        return jsonify({'erro': 'não autorizado'}), 403
+    
+    return jsonify({'perfis': listar_perfis()})
+
+@app.route('/perfis/<nome>')
+def baixar_perfil(nome):
+    """Baixar um perfil (.prof, abrir com pstats/snakeviz) - requer X-Admin-Token"""
+    
+    if not token_admin_valido():
+        return jsonify({'erro': 'não autorizado'}), 403
+    
+    if not nome.endswith('.prof'):
+        return jsonify({'erro': 'perfil inválido'}), 400
+    
+    return send_from_directory(os.path.abspath(PERFIL_DIRETORIO), nome, as_attachment=True)
+
 @app.route('/health')
 def health():
     """Health check para Render"""
@@ -686,6 +1526,12 @@ def main():
         logger.error("❌ Falha ao inicializar banco de dados")
         sys.exit(1)
     
+    # Tarefas agendadas (compactação, resumos). Com o reloader do modo
+    # debug, main() roda no processo pai e no filho: só o filho, que serve
+    # as requisições, inicia o agendador. No gunicorn: gunicorn.conf.py
+    if not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        iniciar_agendador()
+    
     logger.info(f"🌐 Configuração:")
     logger.info(f"   - Porta: {PORT}")
     logger.info(f"   - Debug: {DEBUG}")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📬 BENCHMARK - RESUMOS PERIÓDICOS
+=================================
+
+Mede o job de resumos periódicos em um banco temporário com muitos usuários.
+
+O "Job completo" usa o EnviadorLocal (sem rede). O envio real pelo Twilio
+é uma requisição HTTP por mensagem; a última linha estima esse tempo
+enviando uma amostra com --latencia-envio-ms de espera por mensagem.
+
+Uso:
+    python benchmark_resumos.py
+    python benchmark_resumos.py --usuarios 100000 --lancamentos 5 --processos 4
+    python benchmark_resumos.py --latencia-envio-ms 250 --amostra-envio 200
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+import app
+
+CATEGORIAS = ['Alimentação', 'Transporte', 'Moradia', 'Saúde', 'Lazer', 'Outros']
+
+class EnviadorComLatencia(app.EnviadorLocal):
+    """Enviador local que espera `latencia` segundos por mensagem, como uma chamada HTTP"""
+    
+    def __init__(self, latencia):
+        super().__init__()
+        self.latencia = latencia
+    
+    def enviar(self, usuario, mensagem):
+        time.sleep(self.latencia)
+        super().enviar(usuario, mensagem)
+
+def popular_banco(usuarios, lancamentos_por_usuario):
+    """Inserir lançamentos sintéticos dos 7 dias completos anteriores"""
+    
+    hoje = date.today()
+    conn = sqlite3.connect(app.DB_FILE)
+    
+    linhas = (
+        (
+            f"whatsapp:+55{indice:011d}",
+            'receita' if random.random() < 0.2 else 'gasto',
+            round(random.uniform(5, 500), 2),
+            'lançamento sintético',
+            random.choice(CATEGORIAS),
+            str(hoje - timedelta(days=random.randint(1, 7)))
+        )
+        for indice in range(usuarios)
+        for _ in range(lancamentos_por_usuario)
+    )
+    conn.executemany("""
+        INSERT INTO lancamentos (usuario, tipo, valor, descricao, categoria, data_efetiva)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, linhas)
+    
+    # Uma parte dos usuários desativou as notificações
+    conn.executemany(
+        "INSERT INTO configuracoes_usuario (usuario, notificacoes) VALUES (?, 0)",
+        ((f"whatsapp:+55{indice:011d}",) for indice in range(0, usuarios, 10))
+    )
+    
+    conn.commit()
+    conn.close()
+
+def medir(descricao, funcao):
+    inicio = time.perf_counter()
+    resultado = funcao()
+    print(f"{descricao:<40} {time.perf_counter() - inicio:8.2f}s")
+    return resultado
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--usuarios', type=int, default=100_000)
+    parser.add_argument('--lancamentos', type=int, default=5, help='lançamentos por usuário')
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--periodicidade', choices=['diario', 'semanal'], default='semanal')
+    parser.add_argument('--latencia-envio-ms', type=float, default=250, help='latência simulada por mensagem')
+    parser.add_argument('--amostra-envio', type=int, default=200, help='mensagens enviadas na estimativa')
+    args = parser.parse_args()
+    
+    random.seed(42)
+    
+    with tempfile.TemporaryDirectory() as diretorio:
+        app.DB_FILE = os.path.join(diretorio, 'benchmark.db')
+        app.inicializar_banco()
+        
+        medir(f"Popular {args.usuarios} usuários", lambda: popular_banco(args.usuarios, args.lancamentos))
+        
+        resumos = medir("Consulta agrupada", lambda: list(app.carregar_resumos_periodicos(args.periodicidade)))
+        print(f"   {len(resumos)} usuários com notificações")
+        
+        medir("Renderização (1 processo)", lambda: [app.renderizar_resumo_periodico(r) for r in resumos])
+        
+        for processos in sorted({1, args.processos}):
+            enviador = app.EnviadorLocal()
+            fila = app.FilaSaida(enviador, f"benchmark {processos}")
+            medir(
+                f"Job completo ({processos} processo(s))",
+                lambda: (app.gerar_resumos_periodicos(args.periodicidade, fila, processos=processos), fila.despachar())
+            )
+            assert len(enviador.enviadas) == len(resumos)
+        
+        # Envio real: a latência por mensagem domina o job
+        amostra = min(args.amostra_envio, len(resumos))
+        fila = app.FilaSaida(EnviadorComLatencia(args.latencia_envio_ms / 1000), "benchmark envio")
+        for usuario, mensagem in map(app.renderizar_resumo_periodico, resumos[:amostra]):
+            fila.enfileirar(usuario, mensagem)
+        inicio = time.perf_counter()
+        fila.despachar()
+        por_mensagem = (time.perf_counter() - inicio) / max(amostra, 1)
+        print(f"{'Envio estimado (' + str(args.latencia_envio_ms) + ' ms/msg)':<40} {por_mensagem * len(resumos) / 3600:8.2f}h")
+
+if __name__ == '__main__':
+    main()
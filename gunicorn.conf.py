@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+Configuração do Gunicorn (Procfile: --config gunicorn.conf.py)
+
+O gunicorn não chama app.main(), então o banco e o agendador são
+preparados aqui, em cada worker. O agendador roda em todos os workers,
+mas a reserva em tarefas_agendadas deixa cada execução com um só deles.
+"""
+
+def post_worker_init(worker):
+    """Inicializar banco e agendador depois que o worker carregou o app"""
+    
+    import app
+    
+    app.inicializar_banco()
+    app.iniciar_agendador()